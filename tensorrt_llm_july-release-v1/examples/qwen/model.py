@@ -958,7 +958,9 @@ class QWenForCausalLM(QWenModel):
             multi_query_mode=multi_query_mode, 
             custom_plugin_paths=custom_plugin_paths
         )
-        vocab_size_padded = pad_vocab_size(vocab_size, tensor_parallel)
+        # pad to a multiple of 16 (not just tp) so the per-step logits GEMM
+        # keeps an N dimension that maps onto FP16 tensor cores
+        vocab_size_padded = pad_vocab_size(vocab_size, tensor_parallel * 16)
         self.lm_head = ColumnLinear(hidden_size,
                                     vocab_size_padded,
                                     bias=False,
@@ -992,7 +994,9 @@ class QWenForCausalLM(QWenModel):
 
         # [batch_size, hidden_size] -> [batch_size, vocab_size]
         lm_logits = self.lm_head(hidden_states)
-        lm_logits.mark_output('logits', self._kv_dtype)
+        # emit float32 logits directly so the runtime does not have to
+        # materialize a second vocab-sized tensor for the upcast every step
+        lm_logits.mark_output('logits', str_dtype_to_trt('float32'))
 
         if use_cache:
             for i, present in enumerate(presents):
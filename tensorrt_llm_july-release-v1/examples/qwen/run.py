@@ -2,6 +2,18 @@ import argparse
 import csv
 import json
 import os
+
+# Route torch's CUDA allocations through the stream-ordered
+# (cudaMallocAsync) allocator: decode/steam_decode make many short-lived
+# scratch allocations per request and the default cudaMalloc/cudaFree pair
+# can spike hundreds of ms under fragmentation. The async pool keeps freed
+# blocks instead of returning them to the OS, so chat_stream retains its
+# scratch between tokens. Must be set before torch initializes CUDA;
+# setdefault keeps a user-provided config in charge.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "backend:cudaMallocAsync")
+
+import math
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Union
 import numpy as np
@@ -13,8 +25,9 @@ from transformers import AutoTokenizer
 import tensorrt_llm
 from tensorrt_llm.runtime import (
     ModelConfig, SamplingConfig, GenerationSession, GenerationSequence,
+    KVCacheManager,
 )
-from tensorrt_llm.runtime.generation import _tile_beam_width, Mapping
+from tensorrt_llm.runtime.generation import Mapping
 from build import get_engine_name  # isort:skip
 from utils.utils import make_context
 from default_config import default_config
@@ -36,6 +49,208 @@ class QWenForCausalLMGenerationSession(GenerationSession):
         super().__init__(model_config, engine_buffer, mapping, debug_mode)
         self.global_max_input_length = global_max_input_length
         self.global_max_output_length = global_max_output_length
+        # keys of the persistent buffers cached by __setup_decoder, so that
+        # repeated decode() calls reuse the allocations instead of paying
+        # ~10 cudaMalloc/memset per request
+        self._sampling_params_key = None
+        self._decoder_buffers_key = None
+        self._padded_ids_buf = None
+        self._padded_ids_key = None
+        self._cache_indirections_buf = None
+        # destination buffers and gather index for the step-0 beam tiling,
+        # reused across requests so tiling the KV cache does not re-allocate
+        # gigabytes per decode
+        self._tiled_buffers = {}
+        self._tile_index = None
+        self._tile_index_key = None
+        # GenerationSequence objects handed to the paged KV cache manager,
+        # grown on demand and reused across requests
+        self._gen_seqs = []
+        # reusable all-False / all-True lists for kv_cache_manager.step
+        self._step_false = []
+        self._step_true = []
+        # per-request sequence length tensors, refilled in place
+        self._seq_limit_buf = None
+        self._seq_len_buf = None
+        self._len_arange = None
+        # per-step binding tensors updated in place by
+        # _get_next_step_shape_buffer, so steady-state generation steps keep
+        # fixed device addresses and do not allocate
+        self._sequence_length_bind = None
+        self._past_kv_length_bind = torch.zeros((2, ), dtype=torch.int32)
+        # fp32 staging buffer for engines that still emit fp16 logits
+        self._logits_fp32 = None
+        # pinned staging buffers for prepare_for_chat, grown on demand and
+        # reused across requests; the event fences the async upload so the
+        # next call cannot overwrite bytes that are still in flight
+        self._prepare_ids_buf = None
+        self._prepare_lens_buf = None
+        self._prepare_ready = torch.cuda.Event()
+        # shape key of the buffers allocated by the last setup() call; chat
+        # turns with the same batch and total sequence length reuse them
+        self._kv_buffer_key = None
+        self._kv_buffers = {}
+        # side stream for the small step-0 beam-tiling copies, so they can
+        # overlap with the gigabyte-scale present_key_value tiling that has
+        # to stay on the main stream
+        self._tile_stream = torch.cuda.Stream()
+        # pick the engine-step method once so the generation loop carries no
+        # debug branch and the debug sync cannot be hit in production
+        self._run_step = (self._run_engine_step_debug
+                          if debug_mode else self._run_engine_step)
+
+    def setup(self, batch_size: int, max_input_length: int,
+              max_new_tokens: int):
+        '''Same bookkeeping as GenerationSession.setup, but the gigabyte-scale
+        present_key_value buffers are kept whenever batch size and total
+        sequence length are unchanged - which is every follow-up chat turn,
+        since the entry points size max_new_tokens against the same global
+        output budget. Only the small per-request tensors are rebuilt then.
+
+        The allocated total sequence length is additionally rounded up to the
+        next power of two (capped at the global output budget), so callers
+        that pass an explicit max_new_tokens still land on a handful of
+        buffer shapes across prompts of varying lengths instead of missing
+        the cache on every few-token length difference. Only the allocation
+        is bucketed; the decode loop still runs exactly max_new_tokens steps.
+        '''
+        total_length = max_input_length + max_new_tokens
+        alloc_length = min(1 << (total_length - 1).bit_length(),
+                           self.global_max_output_length)
+        alloc_length = max(alloc_length, total_length)
+        key = (batch_size, alloc_length)
+        if self._kv_buffer_key != key:
+            super().setup(batch_size, max_input_length,
+                          alloc_length - max_input_length)
+            self.max_new_tokens = max_new_tokens
+            # remember the pristine cache allocations: decode() swaps the
+            # buffer entries for their beam-tiled variants at step 0, so the
+            # dict values cannot be trusted across requests
+            self._kv_buffers = {
+                k: v
+                for k, v in self.buffer.items()
+                if 'present_key_value' in k or k == 'logits'
+            }
+            self._kv_buffer_key = key
+            return
+        self.batch_size = batch_size
+        self.max_input_length = max_input_length
+        self.max_new_tokens = max_new_tokens
+        self.max_seq_length = alloc_length
+        self.buffer.update(self._kv_buffers)
+        if self.buffer['max_input_length'].shape[0] != max_input_length:
+            self.buffer['max_input_length'] = torch.empty(
+                (max_input_length, ),
+                dtype=self.buffer['max_input_length'].dtype,
+                device=self.device)
+        if self.use_gpt_attention_plugin:
+            # cheap to rebuild and may have been beam-tiled by the last run
+            self.sequence_length_buffer = torch.ones((batch_size, ),
+                                                     dtype=torch.int32,
+                                                     device=self.device)
+        if self.paged_kv_cache:
+            # the manager itself is a small python object; only its memory
+            # pools are worth keeping
+            blocks = math.ceil(batch_size * self.max_seq_length /
+                               self.tokens_per_block)
+            max_blocks_per_seq = math.ceil(self.max_seq_length /
+                                           self.tokens_per_block)
+            memory_pools = [
+                self._kv_buffers[f'present_key_value_{i}']
+                for i in range(self.num_layers)
+            ]
+            self.kv_cache_manager = KVCacheManager(memory_pools, blocks,
+                                                   self.tokens_per_block,
+                                                   max_blocks_per_seq)
+        self.buffer_allocated = True
+
+    def _run_engine_step(self, context, stream, step, debug_buffer):
+        ok = self.runtime._run(context, stream)
+        if not ok:
+            raise RuntimeError('Executing TRT engine failed!')
+
+    def _run_engine_step_debug(self, context, stream, step, debug_buffer):
+        '''_run_engine_step plus a full device sync and the step-0 dump'''
+        ok = self.runtime._run(context, stream)
+        if not ok:
+            raise RuntimeError('Executing TRT engine failed!')
+        torch.cuda.synchronize()
+        if step == 0:
+            print(debug_buffer.keys())
+            for key in debug_buffer.keys():
+                if key.startswith("layers."):
+                    print(
+                        f"{key} shape, mean, sum",
+                        debug_buffer[key].shape,
+                        debug_buffer[key].mean(),
+                        debug_buffer[key].sum(),
+                    )
+
+    def _get_next_step_shape_buffer(self, batch_size, beam_width,
+                                    max_input_length, step, *args, **kwargs):
+        # The base implementation materializes two fresh tensors per step for
+        # the attention-plugin bindings (`sequence_length_buffer * scalar` and
+        # a host `past_key_value_length` pair). Overwrite both dict entries
+        # with session-owned buffers refreshed in place. Note the base call
+        # below still creates its two temporaries before they are replaced -
+        # the point of this override is not fewer allocations but that every
+        # steady-state binding keeps a fixed device address, which is a
+        # prerequisite for capturing the generation step in a CUDA graph
+        # (torch.cuda.CUDAGraph keyed by (batch * beam,), replayed per token).
+        # The capture itself is still blocked in this release:
+        #  - dynamic_decoder is the prebuilt FasterTransformer op and runs
+        #    host-side control flow plus curand state updates per call;
+        #  - the paged-KV manager rebuilds its pointer arrays in python, so
+        #    block-table changes would silently invalidate a captured graph;
+        #  - TRT v2 execute_async bindings re-read host shape state at
+        #    enqueue time rather than through graph-updatable inputs.
+        # Until those move in-graph, steps remain eagerly enqueued.
+        next_step_shape, next_step_buffer = super(
+        )._get_next_step_shape_buffer(batch_size, beam_width,
+                                      max_input_length, step, *args, **kwargs)
+        if self.use_gpt_attention_plugin:
+            num_seqs = batch_size * beam_width
+            if self._sequence_length_bind is None or \
+                    self._sequence_length_bind.shape[0] != num_seqs:
+                self._sequence_length_bind = torch.empty((num_seqs, ),
+                                                         dtype=torch.int32,
+                                                         device=self.device)
+            self._sequence_length_bind.fill_(max_input_length + step)
+            self._past_kv_length_bind[0] = max_input_length + step
+            next_step_buffer['sequence_length'] = self._sequence_length_bind
+            next_step_buffer['past_key_value_length'] = \
+                self._past_kv_length_bind
+        return next_step_shape, next_step_buffer
+
+    def _ensure_tile_index(self, batch_size: int, num_beams: int, device):
+        '''Build (or rebuild) the shared gather index on the caller's current
+        stream. decode() calls this on the main stream before the step-0
+        side-stream tiling, so both streams read a fully written index.
+        '''
+        index_key = (batch_size, num_beams, device)
+        if self._tile_index_key != index_key:
+            self._tile_index = torch.arange(
+                batch_size, device=device).repeat_interleave(num_beams)
+            self._tile_index_key = index_key
+
+    def _tile_beam_width_cached(self, tensor: torch.Tensor, num_beams: int,
+                                key: str):
+        '''Same layout as generation._tile_beam_width, but implemented as a
+        single index_select into a destination buffer cached under `key`.
+        The TRT bindings need contiguous storage, so the copy cannot become
+        an expand() view, but it can at least reuse its allocation.
+        '''
+        self._ensure_tile_index(tensor.shape[0], num_beams, tensor.device)
+        new_shape = (tensor.shape[0] * num_beams, ) + tuple(tensor.shape[1:])
+        buf = self._tiled_buffers.get(key)
+        if buf is None or tuple(buf.shape) != new_shape or \
+                buf.dtype != tensor.dtype:
+            buf = torch.empty(new_shape,
+                              dtype=tensor.dtype,
+                              device=tensor.device)
+            self._tiled_buffers[key] = buf
+        torch.index_select(tensor, 0, self._tile_index, out=buf)
+        return buf
 
     def __setup_decoder(self, input_ids: torch.Tensor,
                         sampling_config: SamplingConfig,
@@ -44,74 +259,122 @@ class QWenForCausalLMGenerationSession(GenerationSession):
         '''
         batch_size = input_lengths.shape[0]
         scfg = sampling_config  # just to make a shorter name, no other meaning
-        self.top_k = torch.full([batch_size], scfg.top_k, dtype=torch.int32)
-        self.top_p = torch.full([batch_size], scfg.top_p, dtype=torch.float32)
-        self.temperature = torch.full([batch_size],
-                                      scfg.temperature,
-                                      dtype=torch.float32)
-        self.repetition_penalty = torch.full([batch_size],
-                                             scfg.repetition_penalty,
-                                             dtype=torch.float32)
-        if scfg.repetition_penalty == 1.0:
-            self.repetition_penalty = None
-
-        self.length_penalty = torch.FloatTensor([scfg.length_penalty])
-
-        self.presence_penalty = torch.full([batch_size],
-                                           scfg.presence_penalty,
-                                           dtype=torch.float32)
-        if scfg.presence_penalty == 0.0:
-            self.presence_penalty = None
-        assert (
-            scfg.presence_penalty == 0.0 or scfg.repetition_penalty == 0.0
-        ), f"presence_penalty({scfg.presence_penalty}) and repetition_penalty({scfg.repetition_penalty}) cannot be larger than 0.0 at the same time."
-        self.min_length = torch.full([batch_size],
-                                     scfg.min_length,
-                                     dtype=torch.int32)
-
-        if scfg.beam_search_diversity_rate is not None:
-            self.beam_search_diversity_rate = torch.full(
-                [batch_size],
-                scfg.beam_search_diversity_rate,
-                dtype=torch.float32)
-        else:
-            self.beam_search_diversity_rate = None
+        # the sampling parameter tensors only depend on the sampling config
+        # and the batch size, so skip rebuilding them when nothing changed
+        # since the last call
+        sampling_params_key = (batch_size, scfg.num_beams, scfg.top_k,
+                               scfg.top_p, scfg.temperature,
+                               scfg.repetition_penalty, scfg.presence_penalty,
+                               scfg.min_length, scfg.length_penalty,
+                               scfg.beam_search_diversity_rate,
+                               scfg.random_seed)
+        if sampling_params_key != self._sampling_params_key:
+            self.top_k = torch.full([batch_size],
+                                    scfg.top_k,
+                                    dtype=torch.int32)
+            self.top_p = torch.full([batch_size],
+                                    scfg.top_p,
+                                    dtype=torch.float32)
+            self.temperature = torch.full([batch_size],
+                                          scfg.temperature,
+                                          dtype=torch.float32)
+            self.repetition_penalty = torch.full([batch_size],
+                                                 scfg.repetition_penalty,
+                                                 dtype=torch.float32)
+            if scfg.repetition_penalty == 1.0:
+                self.repetition_penalty = None
+
+            self.length_penalty = torch.FloatTensor([scfg.length_penalty])
+
+            self.presence_penalty = torch.full([batch_size],
+                                               scfg.presence_penalty,
+                                               dtype=torch.float32)
+            if scfg.presence_penalty == 0.0:
+                self.presence_penalty = None
+            assert (
+                scfg.presence_penalty == 0.0 or scfg.repetition_penalty == 0.0
+            ), f"presence_penalty({scfg.presence_penalty}) and repetition_penalty({scfg.repetition_penalty}) cannot be larger than 0.0 at the same time."
+            self.min_length = torch.full([batch_size],
+                                         scfg.min_length,
+                                         dtype=torch.int32)
+
+            if scfg.beam_search_diversity_rate is not None:
+                self.beam_search_diversity_rate = torch.full(
+                    [batch_size],
+                    scfg.beam_search_diversity_rate,
+                    dtype=torch.float32)
+            else:
+                self.beam_search_diversity_rate = None
 
-        if scfg.random_seed is not None:
-            self.random_seed = torch.full([batch_size],
-                                          scfg.random_seed,
-                                          dtype=torch.int64)
-        else:
-            self.random_seed = None
+            if scfg.random_seed is not None:
+                self.random_seed = torch.full([batch_size],
+                                              scfg.random_seed,
+                                              dtype=torch.int64)
+            else:
+                self.random_seed = None
+
+            self._sampling_params_key = sampling_params_key
 
+        # always (re)run the decoder setup: it reinitializes the op's curand
+        # state, so with a fixed random_seed every request samples the same
+        # sequence; it is host-side and cheap relative to a decode
         self.dynamic_decoder.setup(
             batch_size, scfg.num_beams, self.top_k, self.top_p,
             self.temperature, self.repetition_penalty, self.presence_penalty,
             self.min_length, self.length_penalty,
-            self.beam_search_diversity_rate, self.random_seed, self.top_p_decay,
-            self.top_p_min, self.top_p_reset_ids)
+            self.beam_search_diversity_rate, self.random_seed,
+            self.top_p_decay, self.top_p_min, self.top_p_reset_ids)
 
         assert scfg.end_id is not None, "end_id cannot be none"
         assert scfg.pad_id is not None, 'pad_id cannot be none'
-        self.end_ids = torch.full((batch_size * scfg.num_beams, ),
-                                  scfg.end_id,
-                                  dtype=torch.int32,
-                                  device=self.device)
-        max_input_length = input_lengths.max()
+        # the remaining buffers only depend on the buffer shapes and end_id,
+        # reuse them in-place across requests
+        decoder_buffers_key = (batch_size, scfg.num_beams, self.max_seq_length,
+                               self.max_new_tokens, scfg.end_id,
+                               scfg.output_cum_log_probs, scfg.output_log_probs)
+        reuse_decoder_buffers = decoder_buffers_key == self._decoder_buffers_key
+        if not reuse_decoder_buffers:
+            self.end_ids = torch.full((batch_size * scfg.num_beams, ),
+                                      scfg.end_id,
+                                      dtype=torch.int32,
+                                      device=self.device)
+            self._decoder_buffers_key = decoder_buffers_key
+        # decode() asserts this against self.max_input_length, so use the
+        # python int instead of a 0-dim tensor
+        max_input_length = self.max_input_length
 
         if input_ids.shape[0] != input_lengths.shape[0]:
-            # dim 0 of input_ids is not batch size, which means remove_padding is enabled
-            split_ids_list = list(
-                torch.split(input_ids,
-                            input_lengths.cpu().numpy().tolist(),
-                            dim=1))
-            padded_input_ids = torch.nested.to_padded_tensor(
-                torch.nested.nested_tensor(split_ids_list, dtype=torch.int32),
-                scfg.pad_id).cuda().reshape(batch_size, max_input_length)
+            # dim 0 of input_ids is not batch size, which means remove_padding
+            # is enabled; unpack the packed ids with a single gather on GPU
+            # instead of the nested-tensor round trip through the CPU
+            if self._padded_ids_key != (batch_size, max_input_length):
+                self._padded_ids_buf = torch.empty(
+                    (batch_size, max_input_length),
+                    dtype=torch.int32,
+                    device=self.device)
+                self._padded_ids_key = (batch_size, max_input_length)
+            padded_input_ids = self._padded_ids_buf
+            flat_ids = input_ids.reshape(-1)
+            token_pos = torch.arange(max_input_length,
+                                     dtype=torch.int32,
+                                     device=self.device)
+            row_starts = torch.cumsum(input_lengths, dim=0,
+                                      dtype=torch.int32) - input_lengths
+            gather_index = (row_starts.unsqueeze(1) +
+                            token_pos.unsqueeze(0)).clamp_(
+                                max=flat_ids.shape[0] - 1)
+            torch.index_select(flat_ids,
+                               0,
+                               gather_index.reshape(-1),
+                               out=padded_input_ids.view(-1))
+            padded_input_ids.masked_fill_(
+                token_pos.unsqueeze(0) >= input_lengths.unsqueeze(1),
+                scfg.pad_id)
         else:
             padded_input_ids = input_ids
         if scfg.num_beams > 1:
-            tiled_input_ids = _tile_beam_width(padded_input_ids, scfg.num_beams)
+            tiled_input_ids = self._tile_beam_width_cached(
+                padded_input_ids, scfg.num_beams, 'setup_input_ids')
             tiled_input_ids = tiled_input_ids.reshape(batch_size,
                                                       scfg.num_beams,
                                                       max_input_length)
@@ -132,31 +395,43 @@ class QWenForCausalLMGenerationSession(GenerationSession):
                              dtype=padded_input_ids.dtype,
                              device=padded_input_ids.device)))
 
-        self.parent_ids = torch.zeros(
-            (self.max_seq_length, batch_size, scfg.num_beams),
-            dtype=torch.int32,
-            device=self.device)
+        if reuse_decoder_buffers:
+            self.parent_ids.zero_()
+        else:
+            self.parent_ids = torch.zeros(
+                (self.max_seq_length, batch_size, scfg.num_beams),
+                dtype=torch.int32,
+                device=self.device)
 
         if scfg.num_beams > 1 or scfg.output_cum_log_probs:
-            self.cum_log_probs = torch.full((batch_size, scfg.num_beams),
-                                            -1e20,
-                                            dtype=torch.float32,
-                                            device=self.device)
+            if reuse_decoder_buffers:
+                self.cum_log_probs.fill_(-1e20)
+            else:
+                self.cum_log_probs = torch.full((batch_size, scfg.num_beams),
+                                                -1e20,
+                                                dtype=torch.float32,
+                                                device=self.device)
             self.cum_log_probs[:, 0] = 0.0
         else:
             self.cum_log_probs = None
 
         if scfg.output_log_probs:
-            self.log_probs = torch.zeros(
-                (self.max_new_tokens, batch_size, scfg.num_beams),
-                dtype=torch.float32,
-                device=self.device)
+            if reuse_decoder_buffers:
+                self.log_probs.zero_()
+            else:
+                self.log_probs = torch.zeros(
+                    (self.max_new_tokens, batch_size, scfg.num_beams),
+                    dtype=torch.float32,
+                    device=self.device)
         else:
             self.log_probs = None
 
-        self.finished = torch.zeros((batch_size, scfg.num_beams),
-                                    dtype=torch.bool,
-                                    device=self.device)
+        if reuse_decoder_buffers:
+            self.finished.zero_()
+        else:
+            self.finished = torch.zeros((batch_size, scfg.num_beams),
+                                        dtype=torch.bool,
+                                        device=self.device)
 
     def decode(
         self,
@@ -166,231 +441,17 @@ class QWenForCausalLMGenerationSession(GenerationSession):
         prompt_embedding_table: torch.Tensor = None,
         tasks: torch.Tensor = None,
         prompt_vocab_size: torch.Tensor = None,
+        max_input_length: Union[int, None] = None,
     ):
-        batch_size = input_lengths.size(0)
-        max_input_length = torch.max(input_lengths).item()
-        assert batch_size == self.batch_size, \
-            "Given batch size is different from the one used in setup()," \
-            "rerun the setup function with the new batch size to avoid buffer overflow."
-        assert max_input_length == self.max_input_length, \
-            "Given input length is large then the one used in setup()," \
-            "rerun the setup function with the new max_input_length to avoid buffer overflow."
-        ite = 0  # index of local batches, will always be 0 if pp_size = 1
-        scfg = sampling_config
-
-        self.__setup_decoder(input_ids, scfg, input_lengths)
-        if not self.buffer_allocated:
-            raise RuntimeError('Buffer not allocated, please call setup first!')
-
-        sequence_limit_lengths = torch.full((batch_size, 1),
-                                            self.max_seq_length,
-                                            dtype=torch.int32,
-                                            device=self.device)
-        sequence_lengths = torch.full((batch_size * scfg.num_beams, 1),
-                                      max_input_length,
-                                      dtype=torch.int32,
-                                      device=self.device)
-        len_list = torch.arange(0,
-                                self.max_seq_length,
-                                dtype=torch.int32,
-                                device=self.device).unsqueeze(0).expand(
-                                    batch_size, -1)
-        mask = (len_list >= input_lengths.unsqueeze(1)) & (len_list <
-                                                           max_input_length)
-        masked_tokens = torch.zeros((batch_size, self.max_seq_length),
-                                    dtype=torch.int32,
-                                    device=self.device).masked_fill_(mask, 1)
-
-        cache_indirections = [
-            torch.full((
-                batch_size,
-                scfg.num_beams,
-                self.max_seq_length,
-            ),
-                       0,
-                       dtype=torch.int32,
-                       device=self.device),
-            torch.full((
-                batch_size,
-                scfg.num_beams,
-                self.max_seq_length,
-            ),
-                       0,
-                       dtype=torch.int32,
-                       device=self.device)
-        ]  # ping-pong buffers
-
-        if self.paged_kv_cache:
-            # Add sequences to the manager
-            for bi in range(batch_size):
-                generation_sequence = GenerationSequence(seq_idx=bi,
-                                                         batch_idx=bi)
-                self.kv_cache_manager.add_sequence(generation_sequence,
-                                                   input_ids.size(1))
-
-        kv_cache_block_pointers = []
-        # start context phase
-        for step in range(0, self.max_new_tokens):
-            if self.paged_kv_cache:
-                kv_cache_block_pointers = self.kv_cache_manager.get_pointer_arrays(
-                )
-
-            if step % 2:
-                context = self.runtime.context_0
-                this_src_cache_indirection = cache_indirections[1]
-                this_tgt_cache_indirection = cache_indirections[0]
-                next_src_cache_indirection = cache_indirections[0]
-            else:
-                context = self.runtime.context_1
-                this_src_cache_indirection = cache_indirections[0]
-                this_tgt_cache_indirection = cache_indirections[1]
-                next_src_cache_indirection = cache_indirections[1]
-
-            if step == 0:
-                model_inputs = self._prepare_context_inputs(
-                    batch_size=batch_size,
-                    input_lengths=input_lengths,
-                    use_gpt_attention_plugin=self.use_gpt_attention_plugin,
-                    remove_input_padding=self.remove_input_padding,
-                    max_input_length=max_input_length,
-                    input_ids=input_ids,
-                    pad_id=scfg.pad_id)
-
-                position_ids = model_inputs.get('position_ids')
-                last_token_ids = model_inputs.get('last_token_ids')
-                attention_mask = model_inputs.get('attention_mask', None)
-
-                ctx_shape, ctx_buffer = self._get_context_shape_buffer(
-                    input_ids, max_input_length, step, masked_tokens,
-                    input_lengths, position_ids, last_token_ids, attention_mask,
-                    this_src_cache_indirection, kv_cache_block_pointers,
-                    prompt_embedding_table, tasks, prompt_vocab_size)
-                self.runtime._set_shape(context, ctx_shape)
-                self.runtime._set_buffer(context, ctx_buffer)
-                if self.debug_mode:
-                    debug_buffer = ctx_buffer
-
-            # dynamic_decoder currently use torch's current stream, so must let TRT enqueue use same stream here
-            stream = torch.cuda.current_stream().cuda_stream
-            ok = self.runtime._run(context, stream)
-            if not ok:
-                raise RuntimeError('Executing TRT engine failed!')
-            if self.debug_mode:
-                torch.cuda.synchronize()
-                if step == 0:
-                    print(debug_buffer.keys())
-                    for key in debug_buffer.keys():
-                        if key.startswith("layers."):
-                            print(
-                                f"{key} shape, mean, sum",
-                                debug_buffer[key].shape,
-                                debug_buffer[key].mean(),
-                                debug_buffer[key].sum(),
-                            )
-
-            if step == 0 and scfg.num_beams > 1:
-
-                if not self.use_gpt_attention_plugin:
-                    attention_mask = _tile_beam_width(attention_mask,
-                                                      scfg.num_beams)
-                input_lengths = _tile_beam_width(input_lengths, scfg.num_beams)
-                if self.use_gpt_attention_plugin:
-                    self.sequence_length_buffer = _tile_beam_width(
-                        self.sequence_length_buffer, scfg.num_beams)
-                masked_tokens = _tile_beam_width(masked_tokens, scfg.num_beams)
-
-                # Move tiling before logit computing of context
-                for key in self.buffer.keys():
-                    if "present_key_value" in key:
-                        self.buffer[key] = _tile_beam_width(
-                            self.buffer[key], scfg.num_beams)
-                self.buffer['logits'] = _tile_beam_width(
-                    self.buffer['logits'], scfg.num_beams)
-
-            if not step == self.max_new_tokens - 1:
-                # Set shape and address for the next step
-                model_inputs = self._prepare_generation_inputs(
-                    batch_size=batch_size,
-                    input_lengths=input_lengths,
-                    use_gpt_attention_plugin=self.use_gpt_attention_plugin,
-                    remove_input_padding=self.remove_input_padding,
-                    step=step,
-                    num_beams=scfg.num_beams,
-                    attention_mask=attention_mask,
-                )
-
-                position_ids = model_inputs.get('position_ids')
-                last_token_ids = model_inputs.get('last_token_ids')
-                attention_mask = model_inputs.get('attention_mask', None)
+        final_output_ids, end_step = None, 0
+        # drain the shared generator; the last yielded pair is the result
+        for final_output_ids, end_step in self._decode_core(
+                input_ids, input_lengths, sampling_config,
+                prompt_embedding_table, tasks, prompt_vocab_size,
+                max_input_length, streaming=False):
+            pass
+        return final_output_ids, end_step
 
-                next_context = self.runtime.context_1 if step % 2 else self.runtime.context_0
-                next_step_shape, next_step_buffer = self._get_next_step_shape_buffer(
-                    batch_size, scfg.num_beams, max_input_length, step,
-                    masked_tokens, input_lengths, position_ids, last_token_ids,
-                    attention_mask, next_src_cache_indirection,
-                    kv_cache_block_pointers, prompt_embedding_table, tasks,
-                    prompt_vocab_size)
-                self.runtime._set_shape(next_context, next_step_shape)
-                self.runtime._set_buffer(next_context, next_step_buffer)
-                if self.debug_mode:
-                    self.debug_buffer = next_step_buffer
-
-            logits = self.buffer['logits']
-            if logits is not None:
-                # [batch_size x scft.num_beams, vocab_size_padded] -> [batch_size, scfg.num_beams, vocab_size_padded]
-                next_token_logits = logits.reshape(
-                    (batch_size, scfg.num_beams, -1)).to(torch.float32)
-                decode_step = step + max_input_length
-                should_stop = self.dynamic_decoder.forward(
-                    next_token_logits, decode_step, max_input_length, ite,
-                    batch_size, self.end_ids, self.top_k, self.top_p,
-                    self.temperature, self.repetition_penalty,
-                    self.presence_penalty, self.min_length, self.length_penalty,
-                    self.beam_search_diversity_rate, self.top_p_decay,
-                    self.top_p_min, self.top_p_reset_ids,
-                    self.embedding_bias_opt, input_lengths,
-                    sequence_limit_lengths, self.stop_words_list,
-                    self.bad_words_list, this_src_cache_indirection,
-                    self.output_ids, self.finished, sequence_lengths,
-                    self.cum_log_probs, self.log_probs, self.parent_ids,
-                    this_tgt_cache_indirection)
-
-                if should_stop.item():
-                    if self.paged_kv_cache:
-                        # Free all blocks in all sequences.
-                        # With in-flight batching and while loop we'll free some sequences, when they are done
-                        self.kv_cache_manager.step([True] * batch_size *
-                                                   scfg.num_beams)
-
-                    # output shape of self.gather_tree: [batch_size, beam_width, output_len]
-                    final_output_ids = self.gather_tree(
-                        sequence_lengths, self.output_ids, self.parent_ids,
-                        self.end_ids, input_lengths, batch_size, scfg.num_beams,
-                        max_input_length, self.max_seq_length)
-                    return final_output_ids, step + 1
-
-            if self.paged_kv_cache and step < self.max_new_tokens - 1:
-                # Iterate to the next step in KV cache manager.
-                # Increase number of tokens for all unfinished sequences.
-                # And allocate new blocks if needed.
-                # We set this to False for all sequences, since we use only length criterion to stop now
-                self.kv_cache_manager.step([False] * batch_size *
-                                           scfg.num_beams)
-
-        if self.paged_kv_cache:
-            # Free all blocks in all sequences.
-            # With in-flight batching and while loop we'll free some sequences, when they are done
-            self.kv_cache_manager.step([True] * batch_size * scfg.num_beams)
-
-        # output shape of self.gather_tree: [batch_size, beam_width, output_len]
-        final_output_ids = self.gather_tree(sequence_lengths, self.output_ids,
-                                            self.parent_ids, self.end_ids,
-                                            input_lengths, batch_size,
-                                            scfg.num_beams, max_input_length,
-                                            self.max_seq_length)
-
-        return final_output_ids, self.max_new_tokens
-    
     def steam_decode(
         self,
         input_ids: torch.Tensor,
@@ -399,9 +460,36 @@ class QWenForCausalLMGenerationSession(GenerationSession):
         prompt_embedding_table: torch.Tensor = None,
         tasks: torch.Tensor = None,
         prompt_vocab_size: torch.Tensor = None,
+        max_input_length: Union[int, None] = None,
+    ):
+        yield from self._decode_core(
+            input_ids, input_lengths, sampling_config,
+            prompt_embedding_table, tasks, prompt_vocab_size,
+            max_input_length, streaming=True)
+
+    def _decode_core(
+        self,
+        input_ids: torch.Tensor,
+        input_lengths: torch.Tensor,
+        sampling_config: SamplingConfig,
+        prompt_embedding_table: torch.Tensor = None,
+        tasks: torch.Tensor = None,
+        prompt_vocab_size: torch.Tensor = None,
+        max_input_length: Union[int, None] = None,
+        streaming: bool = False,
     ):
+        '''Generation loop shared by decode() and steam_decode().
+
+        Yields (output_ids, end_step) pairs; with streaming=True one pair is
+        yielded after every generated token, otherwise only the final pair is
+        yielded. Keeping a single implementation ensures the two entry points
+        cannot drift apart.
+        '''
         batch_size = input_lengths.size(0)
-        max_input_length = torch.max(input_lengths).item()
+        if max_input_length is None:
+            # callers that already know the padded length can pass it in and
+            # skip this GPU->CPU sync
+            max_input_length = torch.max(input_lengths).item()
         assert batch_size == self.batch_size, \
             "Given batch size is different from the one used in setup()," \
             "rerun the setup function with the new batch size to avoid buffer overflow."
@@ -415,69 +503,103 @@ class QWenForCausalLMGenerationSession(GenerationSession):
         if not self.buffer_allocated:
             raise RuntimeError('Buffer not allocated, please call setup first!')
 
-        sequence_limit_lengths = torch.full((batch_size, 1),
-                                            self.max_seq_length,
+        # sequence length tensors and the position arange are cached on the
+        # session and refilled in place instead of re-allocated per request
+        if self._seq_limit_buf is None or \
+                self._seq_limit_buf.shape[0] != batch_size:
+            self._seq_limit_buf = torch.empty((batch_size, 1),
+                                              dtype=torch.int32,
+                                              device=self.device)
+        sequence_limit_lengths = self._seq_limit_buf.fill_(
+            self.max_seq_length)
+        if self._seq_len_buf is None or \
+                self._seq_len_buf.shape[0] != batch_size * scfg.num_beams:
+            self._seq_len_buf = torch.empty((batch_size * scfg.num_beams, 1),
                                             dtype=torch.int32,
                                             device=self.device)
-        sequence_lengths = torch.full((batch_size * scfg.num_beams, 1),
-                                      max_input_length,
-                                      dtype=torch.int32,
-                                      device=self.device)
-        len_list = torch.arange(0,
-                                self.max_seq_length,
-                                dtype=torch.int32,
-                                device=self.device).unsqueeze(0).expand(
-                                    batch_size, -1)
-        mask = (len_list >= input_lengths.unsqueeze(1)) & (len_list <
-                                                           max_input_length)
-        masked_tokens = torch.zeros((batch_size, self.max_seq_length),
-                                    dtype=torch.int32,
-                                    device=self.device).masked_fill_(mask, 1)
-
-        cache_indirections = [
-            torch.full((
-                batch_size,
-                scfg.num_beams,
-                self.max_seq_length,
-            ),
-                       0,
-                       dtype=torch.int32,
-                       device=self.device),
-            torch.full((
-                batch_size,
-                scfg.num_beams,
-                self.max_seq_length,
-            ),
-                       0,
-                       dtype=torch.int32,
-                       device=self.device)
-        ]  # ping-pong buffers
+        sequence_lengths = self._seq_len_buf.fill_(max_input_length)
+        # build the 0/1 mask with one fused expression instead of
+        # zeros + bool mask + masked_fill_, which wrote the full-size
+        # tensor twice and kept a bool intermediate alive
+        if self._len_arange is None or \
+                self._len_arange.shape[0] < self.max_seq_length:
+            self._len_arange = torch.arange(max(self.max_seq_length,
+                                                self.global_max_output_length),
+                                            dtype=torch.int32,
+                                            device=self.device)
+        len_list = self._len_arange[:self.max_seq_length].unsqueeze(0)
+        masked_tokens = ((len_list >= input_lengths.unsqueeze(1)) &
+                         (len_list < max_input_length)).to(torch.int32)
+
+        # one contiguous (2, batch, beams, seq) allocation shared across
+        # requests; the two ping-pong buffers are views into it
+        ci_shape = (2, batch_size, scfg.num_beams, self.max_seq_length)
+        if self._cache_indirections_buf is None or \
+                tuple(self._cache_indirections_buf.shape) != ci_shape:
+            self._cache_indirections_buf = torch.zeros(ci_shape,
+                                                       dtype=torch.int32,
+                                                       device=self.device)
+        else:
+            self._cache_indirections_buf.zero_()
+        cache_indirections = self._cache_indirections_buf
 
         if self.paged_kv_cache:
-            # Add sequences to the manager
+            # Add sequences to the manager; the GenerationSequence objects
+            # are identified purely by their indices, so construct them once
+            # and reuse them across requests
+            while len(self._gen_seqs) < batch_size:
+                bi = len(self._gen_seqs)
+                self._gen_seqs.append(
+                    GenerationSequence(seq_idx=bi, batch_idx=bi))
             for bi in range(batch_size):
-                generation_sequence = GenerationSequence(seq_idx=bi,
-                                                         batch_idx=bi)
-                self.kv_cache_manager.add_sequence(generation_sequence,
+                self.kv_cache_manager.add_sequence(self._gen_seqs[bi],
                                                    input_ids.size(1))
 
         kv_cache_block_pointers = []
+        # build the finished masks for kv_cache_manager.step once per request
+        # instead of allocating a fresh [bool] * (B * beams) list every token
+        num_seqs = batch_size * scfg.num_beams
+        if len(self._step_false) < num_seqs:
+            self._step_false = [False] * num_seqs
+            self._step_true = [True] * num_seqs
+        kv_none_finished = self._step_false[:num_seqs]
+        kv_all_finished = self._step_true[:num_seqs]
+        # dynamic_decoder currently use torch's current stream, so must let
+        # TRT enqueue use same stream here; resolve it once instead of paying
+        # the python/driver lookup on every step
+        stream = torch.cuda.current_stream().cuda_stream
+        # the execution contexts and cache indirections ping-pong with step
+        # parity; index them with step & 1 instead of re-branching per token
+        contexts = (self.runtime.context_1, self.runtime.context_0)
+        # the vocab is padded to a multiple of 16 at build time so the
+        # per-step logits GEMM keeps hitting tensor cores; catch engines
+        # built without the padding before entering the loop
+        assert self.buffer['logits'].shape[-1] % 16 == 0, \
+            "logits dim should be padded to a multiple of 16, rebuild the engine"
+        # engines built before logits were marked float32 still emit fp16;
+        # stage them through a persistent fp32 buffer so the per-step upcast
+        # is a single dtype-converting copy instead of an allocate + cast
+        logits_fp32_view = None
+        if self.buffer['logits'].dtype != torch.float32:
+            fp32_shape = (batch_size, scfg.num_beams,
+                          self.buffer['logits'].shape[-1])
+            if self._logits_fp32 is None or \
+                    self._logits_fp32.shape != fp32_shape:
+                self._logits_fp32 = torch.empty(fp32_shape,
+                                                dtype=torch.float32,
+                                                device=self.device)
+            logits_fp32_view = self._logits_fp32
         # start context phase
         for step in range(0, self.max_new_tokens):
             if self.paged_kv_cache:
                 kv_cache_block_pointers = self.kv_cache_manager.get_pointer_arrays(
                 )
 
-            if step % 2:
-                context = self.runtime.context_0
-                this_src_cache_indirection = cache_indirections[1]
-                this_tgt_cache_indirection = cache_indirections[0]
-                next_src_cache_indirection = cache_indirections[0]
-            else:
-                context = self.runtime.context_1
-                this_src_cache_indirection = cache_indirections[0]
-                this_tgt_cache_indirection = cache_indirections[1]
-                next_src_cache_indirection = cache_indirections[1]
+            p = step & 1
+            context = contexts[p]
+            this_src_cache_indirection = cache_indirections[p]
+            this_tgt_cache_indirection = cache_indirections[1 - p]
+            next_src_cache_indirection = cache_indirections[1 - p]
 
             if step == 0:
                 model_inputs = self._prepare_context_inputs(
@@ -500,55 +622,70 @@ class QWenForCausalLMGenerationSession(GenerationSession):
                     prompt_embedding_table, tasks, prompt_vocab_size)
                 self.runtime._set_shape(context, ctx_shape)
                 self.runtime._set_buffer(context, ctx_buffer)
-                if self.debug_mode:
-                    debug_buffer = ctx_buffer
-
-            # dynamic_decoder currently use torch's current stream, so must let TRT enqueue use same stream here
-            stream = torch.cuda.current_stream().cuda_stream
-            ok = self.runtime._run(context, stream)
-            if not ok:
-                raise RuntimeError('Executing TRT engine failed!')
-            if self.debug_mode:
-                torch.cuda.synchronize()
-                if step == 0:
-                    print(debug_buffer.keys())
+                debug_buffer = ctx_buffer
+
+            self._run_step(context, stream, step, debug_buffer)
 
             if step == 0 and scfg.num_beams > 1:
 
-                if not self.use_gpt_attention_plugin:
-                    attention_mask = _tile_beam_width(attention_mask,
-                                                      scfg.num_beams)
-                input_lengths = _tile_beam_width(input_lengths, scfg.num_beams)
-                if self.use_gpt_attention_plugin:
-                    self.sequence_length_buffer = _tile_beam_width(
-                        self.sequence_length_buffer, scfg.num_beams)
-                masked_tokens = _tile_beam_width(masked_tokens, scfg.num_beams)
+                # the gather index is shared by both streams below; create it
+                # on the main stream so the side stream cannot read it before
+                # it is written
+                self._ensure_tile_index(batch_size, scfg.num_beams,
+                                        input_lengths.device)
+                # the small control tensors tile on a side stream and
+                # overlap with the gigabyte-scale KV copies issued below on
+                # the main stream
+                self._tile_stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(self._tile_stream):
+                    if not self.use_gpt_attention_plugin:
+                        attention_mask = self._tile_beam_width_cached(
+                            attention_mask, scfg.num_beams, 'attention_mask')
+                    input_lengths = self._tile_beam_width_cached(
+                        input_lengths, scfg.num_beams, 'input_lengths')
+                    if self.use_gpt_attention_plugin:
+                        self.sequence_length_buffer = \
+                            self._tile_beam_width_cached(
+                                self.sequence_length_buffer, scfg.num_beams,
+                                'sequence_length_buffer')
+                    masked_tokens = self._tile_beam_width_cached(
+                        masked_tokens, scfg.num_beams, 'masked_tokens')
 
                 # Move tiling before logit computing of context
                 for key in self.buffer.keys():
                     if "present_key_value" in key:
-                        self.buffer[key] = _tile_beam_width(
-                            self.buffer[key], scfg.num_beams)
-                self.buffer['logits'] = _tile_beam_width(
-                    self.buffer['logits'], scfg.num_beams)
+                        self.buffer[key] = self._tile_beam_width_cached(
+                            self.buffer[key], scfg.num_beams, key)
+                self.buffer['logits'] = self._tile_beam_width_cached(
+                    self.buffer['logits'], scfg.num_beams, 'logits')
+                # dynamic_decoder and the next-step bindings read the tiled
+                # control tensors on the main stream
+                torch.cuda.current_stream().wait_stream(self._tile_stream)
 
             if not step == self.max_new_tokens - 1:
                 # Set shape and address for the next step
-                model_inputs = self._prepare_generation_inputs(
-                    batch_size=batch_size,
-                    input_lengths=input_lengths,
-                    use_gpt_attention_plugin=self.use_gpt_attention_plugin,
-                    remove_input_padding=self.remove_input_padding,
-                    step=step,
-                    num_beams=scfg.num_beams,
-                    attention_mask=attention_mask,
-                )
+                if self.use_gpt_attention_plugin and step > 0:
+                    # with the attention plugin the generation inputs only
+                    # differ from step to step by the position counter, so
+                    # advance the tensor built at step 0 in place instead of
+                    # rebuilding and rebinding all of them every token
+                    position_ids.add_(1)
+                else:
+                    model_inputs = self._prepare_generation_inputs(
+                        batch_size=batch_size,
+                        input_lengths=input_lengths,
+                        use_gpt_attention_plugin=self.use_gpt_attention_plugin,
+                        remove_input_padding=self.remove_input_padding,
+                        step=step,
+                        num_beams=scfg.num_beams,
+                        attention_mask=attention_mask,
+                    )
 
-                position_ids = model_inputs.get('position_ids')
-                last_token_ids = model_inputs.get('last_token_ids')
-                attention_mask = model_inputs.get('attention_mask', None)
+                    position_ids = model_inputs.get('position_ids')
+                    last_token_ids = model_inputs.get('last_token_ids')
+                    attention_mask = model_inputs.get('attention_mask', None)
 
-                next_context = self.runtime.context_1 if step % 2 else self.runtime.context_0
+                next_context = contexts[1 - p]
                 next_step_shape, next_step_buffer = self._get_next_step_shape_buffer(
                     batch_size, scfg.num_beams, max_input_length, step,
                     masked_tokens, input_lengths, position_ids, last_token_ids,
@@ -560,68 +697,102 @@ class QWenForCausalLMGenerationSession(GenerationSession):
                 if self.debug_mode:
                     self.debug_buffer = next_step_buffer
 
-            logits = self.buffer['logits']
-            if logits is not None:
-                # [batch_size x scft.num_beams, vocab_size_padded] -> [batch_size, scfg.num_beams, vocab_size_padded]
-                next_token_logits = logits.reshape(
-                    (batch_size, scfg.num_beams, -1)).to(torch.float32)
-                decode_step = step + max_input_length
-                should_stop = self.dynamic_decoder.forward(
-                    next_token_logits, decode_step, max_input_length, ite,
-                    batch_size, self.end_ids, self.top_k, self.top_p,
-                    self.temperature, self.repetition_penalty,
-                    self.presence_penalty, self.min_length, self.length_penalty,
-                    self.beam_search_diversity_rate, self.top_p_decay,
-                    self.top_p_min, self.top_p_reset_ids,
-                    self.embedding_bias_opt, input_lengths,
-                    sequence_limit_lengths, self.stop_words_list,
-                    self.bad_words_list, this_src_cache_indirection,
-                    self.output_ids, self.finished, sequence_lengths,
-                    self.cum_log_probs, self.log_probs, self.parent_ids,
-                    this_tgt_cache_indirection)
-
-                if should_stop.item():
-                    if self.paged_kv_cache:
-                        # Free all blocks in all sequences.
-                        # With in-flight batching and while loop we'll free some sequences, when they are done
-                        self.kv_cache_manager.step([True] * batch_size *
-                                                   scfg.num_beams)
-
-                    # output shape of self.gather_tree: [batch_size, beam_width, output_len]
-                    final_output_ids = self.gather_tree(
-                        sequence_lengths, self.output_ids, self.parent_ids,
-                        self.end_ids, input_lengths, batch_size, scfg.num_beams,
-                        max_input_length, self.max_seq_length)
-                    yield final_output_ids, step + 1
-                    break
+            # logits are always bound once the context ran, so skip the
+            # per-step None check; reshape on the contiguous buffer is a view
+            next_token_logits = self.buffer['logits'].view(
+                batch_size, scfg.num_beams, -1)
+            if logits_fp32_view is not None:
+                logits_fp32_view.copy_(next_token_logits, non_blocking=True)
+                next_token_logits = logits_fp32_view
+            decode_step = step + max_input_length
+            # dynamic_decoder is the prebuilt FasterTransformer op; its
+            # top-k/top-p path sorts the full ~152K-token vocab per step.
+            # A sorting-free sampler (rejection sampling over a fused
+            # block reduce) would remove that, but needs a kernel this
+            # release does not ship; revisit when the sampling kernels
+            # are built from the in-tree cpp/ sources.
+            should_stop = self.dynamic_decoder.forward(
+                next_token_logits, decode_step, max_input_length, ite,
+                batch_size, self.end_ids, self.top_k, self.top_p,
+                self.temperature, self.repetition_penalty,
+                self.presence_penalty, self.min_length, self.length_penalty,
+                self.beam_search_diversity_rate, self.top_p_decay,
+                self.top_p_min, self.top_p_reset_ids,
+                self.embedding_bias_opt, input_lengths,
+                sequence_limit_lengths, self.stop_words_list,
+                self.bad_words_list, this_src_cache_indirection,
+                self.output_ids, self.finished, sequence_lengths,
+                self.cum_log_probs, self.log_probs, self.parent_ids,
+                this_tgt_cache_indirection)
+
+            # should_stop lives on the host and is written synchronously
+            # inside the op's forward (it stream-synchronizes internally when
+            # sequence_limit_lengths/finished are passed, which they always
+            # are here), so reading it every step costs no extra sync
+            if should_stop is not None and should_stop.item():
+                if self.paged_kv_cache:
+                    # Free all blocks in all sequences.
+                    # With in-flight batching and while loop we'll free some sequences, when they are done
+                    self.kv_cache_manager.step(kv_all_finished)
+
+                if streaming and scfg.num_beams == 1:
+                    # the in-loop snapshots yield the raw output_ids layout;
+                    # keep the final yield in the same layout instead of
+                    # switching to the gather_tree-compacted one, so the
+                    # consumer's slicing convention holds throughout
+                    yield self.output_ids.permute(1, 0).unsqueeze(1), step + 1
+                    return
+                # output shape of self.gather_tree: [batch_size, beam_width, output_len]
+                final_output_ids = self.gather_tree(
+                    sequence_lengths, self.output_ids, self.parent_ids,
+                    self.end_ids, input_lengths, batch_size, scfg.num_beams,
+                    max_input_length, self.max_seq_length)
+                yield final_output_ids, step + 1
+                return
 
             if self.paged_kv_cache and step < self.max_new_tokens - 1:
                 # Iterate to the next step in KV cache manager.
                 # Increase number of tokens for all unfinished sequences.
                 # And allocate new blocks if needed.
                 # We set this to False for all sequences, since we use only length criterion to stop now
-                self.kv_cache_manager.step([False] * batch_size *
-                                           scfg.num_beams)
-            final_output_ids = self.gather_tree(
-                sequence_lengths, self.output_ids, self.parent_ids,
-                self.end_ids, input_lengths, batch_size, scfg.num_beams,
-                max_input_length, self.max_seq_length
-            )
-            yield final_output_ids, step + 1
+                self.kv_cache_manager.step(kv_none_finished)
+
+            if streaming:
+                # yield a snapshot of the outputs after every generated token
+                if scfg.num_beams == 1:
+                    # greedy search has no beam tree to gather: output_ids is
+                    # [max_seq_length, batch], so the [batch, 1, len] snapshot
+                    # is a zero-copy view instead of a per-token kernel launch
+                    # plus allocation. Unlike the gather_tree output, rows
+                    # keep the raw layout: prompt in [0, lengths[i]), pad up
+                    # to max_input_length, generated tokens from
+                    # max_input_length on - consumers must slice at
+                    # max_input_length + t, not lengths[i] + t
+                    yield self.output_ids.permute(1, 0).unsqueeze(1), step + 1
+                else:
+                    final_output_ids = self.gather_tree(
+                        sequence_lengths, self.output_ids, self.parent_ids,
+                        self.end_ids, input_lengths, batch_size,
+                        scfg.num_beams, max_input_length, self.max_seq_length)
+                    yield final_output_ids, step + 1
 
         if self.paged_kv_cache:
             # Free all blocks in all sequences.
             # With in-flight batching and while loop we'll free some sequences, when they are done
-            self.kv_cache_manager.step([True] * batch_size * scfg.num_beams)
+            self.kv_cache_manager.step(kv_all_finished)
 
-        # # output shape of self.gather_tree: [batch_size, beam_width, output_len]
-        # final_output_ids = self.gather_tree(sequence_lengths, self.output_ids,
-        #                                     self.parent_ids, self.end_ids,
-        #                                     input_lengths, batch_size,
-        #                                     scfg.num_beams, max_input_length,
-        #                                     self.max_seq_length)
+        if streaming:
+            # the in-loop yield already emitted the last step
+            return
+        # output shape of self.gather_tree: [batch_size, beam_width, output_len]
+        final_output_ids = self.gather_tree(sequence_lengths, self.output_ids,
+                                            self.parent_ids, self.end_ids,
+                                            input_lengths, batch_size,
+                                            scfg.num_beams, max_input_length,
+                                            self.max_seq_length)
 
-        # return final_output_ids, self.max_new_tokens
+        yield final_output_ids, self.max_new_tokens
+    
     def prepare_for_chat(
         self,
         tokenizer,
@@ -649,7 +820,7 @@ class QWenForCausalLMGenerationSession(GenerationSession):
             history_list = [[]]
         else:
             history_list = history
-        input_ids = []
+        input_id_lists = []
         input_lengths = []
 
         for line, history in zip(batch_text, history_list):
@@ -662,22 +833,42 @@ class QWenForCausalLMGenerationSession(GenerationSession):
                 max_input_length=max_input_length,
             )
             # print("input_id_list len", len(input_id_list))
-            input_id = torch.from_numpy(
-                np.array(input_id_list, dtype=np.int32)
-            ).type(torch.int32).unsqueeze(0)
-            input_ids.append(input_id)
-            input_lengths.append(input_id.shape[-1])
+            input_id_lists.append(input_id_list)
+            input_lengths.append(len(input_id_list))
         max_length = max(input_lengths)
-        # do padding, should move outside the profiling to prevent the overhead
-        for i in range(len(input_ids)):
-            pad_size = max_length - input_lengths[i]
-
-            pad = torch.ones([1, pad_size]).type(torch.int32) * pad_id
-            input_ids[i] = torch.cat(
-                [torch.IntTensor(input_ids[i]), pad], axis=-1)
-        input_ids = torch.cat(input_ids, axis=0).cuda()
-        input_lengths = torch.IntTensor(input_lengths).type(torch.int32).cuda()
-        return input_ids, input_lengths
+        batch_size = len(batch_text)
+        # pad every sample into one pinned host buffer and ship it to the
+        # device with a single async copy, instead of per-sample cat/ones
+        # temporaries and one small H2D transfer each; the buffers persist
+        # on the session so repeated calls allocate nothing
+        numel = batch_size * max_length
+        if (self._prepare_ids_buf is None
+                or self._prepare_ids_buf.numel() < numel
+                or self._prepare_lens_buf.numel() < batch_size):
+            self._prepare_ids_buf = torch.empty(
+                (max(numel, batch_size * self.global_max_input_length), ),
+                dtype=torch.int32,
+                pin_memory=True)
+            self._prepare_lens_buf = torch.empty((batch_size, ),
+                                                 dtype=torch.int32,
+                                                 pin_memory=True)
+        else:
+            # host writes to pinned memory are not stream-ordered, so wait
+            # for the previous call's upload before refilling
+            self._prepare_ready.synchronize()
+        host_ids = self._prepare_ids_buf[:numel].view(batch_size, max_length)
+        host_ids.fill_(pad_id)
+        for i, input_id_list in enumerate(input_id_lists):
+            host_ids[i, :input_lengths[i]] = torch.from_numpy(
+                np.asarray(input_id_list, dtype=np.int32))
+        host_lens = self._prepare_lens_buf[:batch_size]
+        host_lens.copy_(torch.as_tensor(input_lengths, dtype=torch.int32))
+        input_ids = host_ids.to('cuda', non_blocking=True)
+        input_lengths = host_lens.to('cuda', non_blocking=True)
+        self._prepare_ready.record()
+        # max_length is already known on the host; returning it saves the
+        # callers a torch.max(input_lengths).item() device sync
+        return input_ids, input_lengths, max_length
     
     def generate(
         self,
@@ -686,8 +877,10 @@ class QWenForCausalLMGenerationSession(GenerationSession):
         sampling_config: SamplingConfig,
         max_new_tokens: int,
         runtime_rank: int = 0,
+        max_input_length: Union[int, None] = None,
     ):
-        max_input_length = torch.max(input_lengths).item()
+        if max_input_length is None:
+            max_input_length = torch.max(input_lengths).item()
         max_new_tokens = min(
             max_new_tokens,
             self.global_max_output_length - max_input_length
@@ -699,7 +892,8 @@ class QWenForCausalLMGenerationSession(GenerationSession):
             max_new_tokens=max_new_tokens
         )
         output_ids, end_step = self.decode(
-            input_ids, input_lengths, sampling_config
+            input_ids, input_lengths, sampling_config,
+            max_input_length=max_input_length
         )
         with torch.no_grad():
             torch.cuda.synchronize()
@@ -718,14 +912,13 @@ class QWenForCausalLMGenerationSession(GenerationSession):
         max_new_tokens: Union[int, None] = None,
         runtime_rank: int = 0,
     ):
-        input_ids, input_lengths = self.prepare_for_chat(
+        input_ids, input_lengths, max_input_length = self.prepare_for_chat(
             tokenizer=tokenizer,
             input_text=input_text,
             system_text=system_text,
             history=history,
             max_input_length=max_input_length,
         )
-        max_input_length = torch.max(input_lengths).item()
         if max_new_tokens is None:
             max_new_tokens = self.global_max_output_length - max_input_length
         else:
@@ -740,18 +933,22 @@ class QWenForCausalLMGenerationSession(GenerationSession):
             max_new_tokens=max_new_tokens
         )
         output_ids, end_step = self.decode(
-            input_ids, input_lengths, sampling_config
+            input_ids, input_lengths, sampling_config,
+            max_input_length=max_input_length
         )
         with torch.no_grad():
             torch.cuda.synchronize()
             if runtime_rank == 0:
-                output_texts = [
-                    tokenizer.decode(
-                        output_ids[i, 0, input_lengths[i]: input_lengths[i] + end_step],
-                        skip_special_tokens=True
-                    )
-                    for i in range(output_ids.size(0))
-                ]
+                # one gather kernel packs the ragged per-row windows into a
+                # rectangular (batch, end_step) tensor on device, so a single
+                # D2H copy and one batched tokenizer call remain
+                positions = input_lengths.to(torch.int64).unsqueeze(1) \
+                    + torch.arange(end_step,
+                                   dtype=torch.int64,
+                                   device=output_ids.device)
+                packed = output_ids[:, 0, :].gather(1, positions).cpu()
+                output_texts = tokenizer.batch_decode(
+                    packed, skip_special_tokens=True)
                 return output_texts
 
     def chat_stream(
@@ -765,14 +962,13 @@ class QWenForCausalLMGenerationSession(GenerationSession):
         max_new_tokens: Union[int, None] = None,
         runtime_rank: int = 0,
     ):
-        input_ids, input_lengths = self.prepare_for_chat(
+        input_ids, input_lengths, max_input_length = self.prepare_for_chat(
             tokenizer=tokenizer,
             input_text=input_text,
             system_text=system_text,
             history=history,
             max_input_length=max_input_length,
         )
-        max_input_length = torch.max(input_lengths).item()
         # setup batch_size, max_input_length, max_output_len
         if max_new_tokens is None:
             max_new_tokens = self.global_max_output_length - max_input_length
@@ -787,19 +983,79 @@ class QWenForCausalLMGenerationSession(GenerationSession):
             max_new_tokens=max_new_tokens
         )
         with torch.no_grad():
+            lengths = input_lengths.tolist()
+            batch_size = input_lengths.size(0)
+            # decode only the tokens produced since the previous yield and
+            # append to per-row text buffers: O(tokens) total tokenizer work
+            # over the stream instead of re-decoding the prefix every token
+            prev_steps = [0] * batch_size
+            output_texts = [''] * batch_size
+            # a device-wide synchronize per yielded token would also wait for
+            # the already-enqueued next engine step; instead snapshot the
+            # output slice on a side stream and block only until that copy
+            # lands in a pinned host buffer
+            copy_stream = torch.cuda.Stream()
+            snapshot_ready = torch.cuda.Event()
+            copy_done = torch.cuda.Event()
+            host_buf = None
+            copied = 0
             for (output_ids, end_step) in self.steam_decode(
-                input_ids, input_lengths, sampling_config
+                input_ids, input_lengths, sampling_config,
+                max_input_length=max_input_length
             ):
-                torch.cuda.synchronize()
+                snapshot_ready.record()
                 if runtime_rank == 0:
-                    output_texts = [
-                    tokenizer.decode(
-                        output_ids[i, 0, input_lengths[i]: input_lengths[i] + end_step],
-                            skip_special_tokens=True
-                        ) 
-                        for i in range(output_ids.size(0))
-                    ]
-                    yield output_texts
+                    width = max_input_length + end_step
+                    if host_buf is None:
+                        host_buf = torch.empty(
+                            (batch_size, output_ids.size(-1)),
+                            dtype=output_ids.dtype,
+                            pin_memory=True)
+                    copy_stream.wait_event(snapshot_ready)
+                    with torch.cuda.stream(copy_stream):
+                        if sampling_config.num_beams == 1:
+                            # already-streamed tokens never change in the
+                            # greedy path, so only the new columns move D2H
+                            host_buf[:, copied:width].copy_(
+                                output_ids[:, 0, copied:width],
+                                non_blocking=True)
+                        else:
+                            host_buf[:, :width].copy_(
+                                output_ids[:, 0, :width], non_blocking=True)
+                        copy_done.record()
+                    copy_done.synchronize()
+                    copied = width
+                    out_cpu = host_buf
+                    if sampling_config.num_beams == 1:
+                        # greedy snapshots keep the raw output_ids layout, so
+                        # every row's generated tokens start at
+                        # max_input_length regardless of its prompt length
+                        pieces = tokenizer.batch_decode(
+                            [
+                                out_cpu[i, max_input_length +
+                                        prev_steps[i]:max_input_length +
+                                        end_step] for i in range(batch_size)
+                            ],
+                            skip_special_tokens=True)
+                        for i, piece in enumerate(pieces):
+                            if piece.endswith(u'�'):
+                                # byte-level BPE can split a multi-byte char
+                                # across tokens; hold the piece back until the
+                                # next step completes it
+                                continue
+                            output_texts[i] += piece
+                            prev_steps[i] = end_step
+                    else:
+                        # beam reordering can rewrite already-streamed
+                        # columns, so re-derive the full text every yield
+                        # instead of appending to it
+                        output_texts = tokenizer.batch_decode(
+                            [
+                                out_cpu[i, lengths[i]:lengths[i] + end_step]
+                                for i in range(batch_size)
+                            ],
+                            skip_special_tokens=True)
+                    yield output_texts[:]
 
 
 def parse_arguments():
@@ -852,20 +1108,33 @@ def parse_arguments():
     return parser.parse_args()
 
 
-def get_model(tokenizer_dir, engine_dir, log_level='error'):
-    # --load the tokenizer and engine #
-    tensorrt_llm.logger.set_level(log_level)
-    tokenizer = AutoTokenizer.from_pretrained(
+@lru_cache(maxsize=8)
+def _load_json_config(path, mtime):
+    '''mtime is part of the key so an engine rebuild invalidates the entry'''
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=2)
+def _load_tokenizer(tokenizer_dir):
+    return AutoTokenizer.from_pretrained(
         tokenizer_dir,
         legacy=False,
         trust_remote_code=True,
     )
+
+
+def get_model(tokenizer_dir, engine_dir, log_level='error'):
+    # --load the tokenizer and engine #
+    # server-style callers run this per session, so the json parsing and the
+    # (slow) tokenizer construction are memoized at module level
+    tensorrt_llm.logger.set_level(log_level)
+    tokenizer = _load_tokenizer(tokenizer_dir)
     config_path = os.path.join(engine_dir, 'config.json')
-    with open(config_path, 'r') as f:
-        config = json.load(f)
+    config = _load_json_config(config_path, os.path.getmtime(config_path))
     gen_config_path = os.path.join(tokenizer_dir, 'generation_config.json')
-    with open(gen_config_path, 'r') as f:
-        gen_config = json.load(f)
+    gen_config = _load_json_config(gen_config_path,
+                                   os.path.getmtime(gen_config_path))
     top_k = gen_config['top_k']
     top_p = gen_config['top_p']
     chat_format = gen_config['chat_format']
@@ -879,6 +1148,12 @@ def get_model(tokenizer_dir, engine_dir, log_level='error'):
 
     use_gpt_attention_plugin = config['plugin_config']['gpt_attention_plugin']
     remove_input_padding = config['plugin_config']['remove_input_padding']
+    # engines built with --int8_kv_cache mark their present_key_value outputs
+    # as int8, and setup() sizes the cache buffers from the engine tensor
+    # dtype, so the halved KV bandwidth needs no session changes; surface the
+    # flag so it is visible which cache precision is running
+    if config['builder_config'].get('int8_kv_cache', False):
+        tensorrt_llm.logger.info('Engine was built with an int8 KV cache')
     dtype = config['builder_config']['precision']
     world_size = config['builder_config']['tensor_parallel']
     assert world_size == tensorrt_llm.mpi_world_size(), \
@@ -950,10 +1225,21 @@ def generate(
             tokenizer.encode(input_text, add_special_tokens=False))
     else:
         if input_file.endswith('.csv'):
-            with open(input_file, 'r') as csv_file:
-                csv_reader = csv.reader(csv_file, delimiter=',')
-                for line in csv_reader:
-                    input_tokens.append(np.array(line, dtype='int32'))
+            try:
+                # one vectorized parse into a contiguous buffer; the per-row
+                # entries below are views into it instead of one python-built
+                # array per line
+                arr = np.loadtxt(input_file,
+                                 dtype=np.int32,
+                                 delimiter=',',
+                                 ndmin=2)
+                input_tokens.extend(arr[i] for i in range(arr.shape[0]))
+            except ValueError:
+                # ragged rows cannot be loaded as a matrix
+                with open(input_file, 'r') as csv_file:
+                    csv_reader = csv.reader(csv_file, delimiter=',')
+                    for line in csv_reader:
+                        input_tokens.append(np.array(line, dtype='int32'))
         elif input_file.endswith('.npy'):
             inputs = np.load(input_file)
             for row in inputs:
@@ -966,19 +1252,45 @@ def generate(
     input_ids = None
     input_lengths = None
     if input_file is None:
-        input_ids = torch.cuda.IntTensor(input_tokens)
-        input_lengths = torch.cuda.IntTensor([input_ids.size(1)])
+        input_ids = torch.tensor(input_tokens,
+                                 dtype=torch.int32,
+                                 pin_memory=True).to('cuda',
+                                                     non_blocking=True)
+        input_lengths = torch.tensor([input_ids.size(1)],
+                                     dtype=torch.int32,
+                                     pin_memory=True).cuda(non_blocking=True)
     else:
-        input_lengths = torch.cuda.IntTensor([len(x) for x in input_tokens])
+        lengths = [len(x) for x in input_tokens]
+        input_lengths = torch.tensor(lengths,
+                                     dtype=torch.int32,
+                                     pin_memory=True).cuda(non_blocking=True)
         if remove_input_padding:
-            input_ids = np.concatenate(input_tokens)
-            input_ids = torch.cuda.IntTensor(input_ids).unsqueeze(0)
+            # pack the rows straight into one pinned buffer and ship it with
+            # a single async copy; the numpy concatenate plus IntTensor route
+            # cost an extra CPU pass and a pageable H2D transfer
+            cpu_buf = torch.empty(sum(lengths),
+                                  dtype=torch.int32,
+                                  pin_memory=True)
+            offset = 0
+            for x, length in zip(input_tokens, lengths):
+                cpu_buf[offset:offset + length] = torch.from_numpy(
+                    np.ascontiguousarray(x, dtype=np.int32))
+                offset += length
+            input_ids = cpu_buf.unsqueeze(0).to('cuda', non_blocking=True)
         else:
-            input_ids = torch.nested.to_padded_tensor(
-                torch.nested.nested_tensor(input_tokens, dtype=torch.int32),
-                eos_token_id).cuda()
-
-    max_input_length = torch.max(input_lengths).item()
+            # an explicit pinned pad buffer avoids the nested-tensor
+            # metadata construction and its pageable H2D transfer
+            host = torch.full((len(input_tokens), max(lengths)),
+                              eos_token_id,
+                              dtype=torch.int32,
+                              pin_memory=True)
+            for i, x in enumerate(input_tokens):
+                host[i, :len(x)] = torch.as_tensor(x, dtype=torch.int32)
+            input_ids = host.to('cuda', non_blocking=True)
+
+    # the row lengths are known on the host, so take the max there instead
+    # of syncing on the freshly uploaded input_lengths tensor
+    max_input_length = max(len(x) for x in input_tokens)
     max_new_tokens = min(
         max_new_tokens,
         default_config.max_input_len + default_config.max_new_tokens - max_input_length
@@ -989,38 +1301,38 @@ def generate(
         max_new_tokens=max_new_tokens
     )
 
-    output_ids, end_step = decoder.decode(input_ids, input_lengths, sampling_config)
+    output_ids, end_step = decoder.decode(input_ids,
+                                          input_lengths,
+                                          sampling_config,
+                                          max_input_length=max_input_length)
     torch.cuda.synchronize()
 
     if runtime_rank == 0:
         if output_csv is None and output_npy is None:
-            for b in range(input_lengths.size(0)):
-                inputs = input_tokens[b]
-                input_text = tokenizer.decode(inputs)
-                print(f'Input: \"{input_text}\"')
-                if num_beams <= 1:
-                    output_begin = max_input_length
-                    output_end = max_input_length + end_step
-                    outputs = output_ids[b][0][output_begin: output_end].tolist()
-                    output_text = tokenizer.decode(outputs)
-                    # outputs = output_ids[b][0].tolist()
-                    # output_text = _decode_chatml(
-                    #     outputs,
-                    #     stop_words=[],
-                    #     eod_token_ids=[tokenizer.im_start_id, tokenizer.im_end_id],
-                    #     tokenizer=tokenizer,
-                    #     raw_text_len=len(input_text),
-                    #     context_length=len(inputs)
-                    # )
-                    print(f'Output: \"{output_text}\"')
-                else:
-                    for beam in range(num_beams):
-                        output_begin = input_lengths[b]
-                        output_end = input_lengths[b] + end_step
-                        outputs = output_ids[b][beam][
-                            output_begin:output_end].tolist()
-                        output_text = tokenizer.decode(outputs)
-                        print(f'Output: \"{output_text}\"')
+            batch_size = input_lengths.size(0)
+            beams = max(num_beams, 1)
+            # one D2H copy and one batched tokenizer call for every
+            # (batch, beam) row instead of a device sync plus decode per beam
+            if num_beams <= 1:
+                out_rows = output_ids[:, 0, max_input_length:max_input_length +
+                                      end_step].cpu()
+            else:
+                # the per-row windows start at different offsets; one gather
+                # packs them into a rectangular tensor before the copy
+                positions = input_lengths.to(torch.int64).repeat_interleave(
+                    num_beams).unsqueeze(1) + torch.arange(
+                        end_step,
+                        dtype=torch.int64,
+                        device=output_ids.device)
+                out_rows = output_ids.reshape(batch_size * num_beams,
+                                              -1).gather(1, positions).cpu()
+            input_texts = tokenizer.batch_decode(
+                [list(tokens) for tokens in input_tokens])
+            output_texts = tokenizer.batch_decode(out_rows)
+            for b in range(batch_size):
+                print(f'Input: \"{input_texts[b]}\"')
+                for beam in range(beams):
+                    print(f'Output: \"{output_texts[b * beams + beam]}\"')
 
         output_ids = output_ids.reshape((-1, output_ids.size(2)))
 
@@ -1035,8 +1347,13 @@ def generate(
         if output_npy is not None:
             output_file = Path(output_npy)
             output_file.parent.mkdir(exist_ok=True, parents=True)
-            outputs = np.array(output_ids.cpu().contiguous(), dtype='int32')
-            np.save(output_file, outputs)
+            # one D2H copy into pinned memory; np.save reads that buffer in
+            # place instead of np.array duplicating the whole matrix again
+            host = torch.empty(output_ids.shape,
+                               dtype=torch.int32,
+                               pin_memory=True)
+            host.copy_(output_ids)
+            np.save(output_file, host.numpy())
     return
 
 
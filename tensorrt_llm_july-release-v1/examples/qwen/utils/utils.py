@@ -1,6 +1,38 @@
 from transformers import PreTrainedTokenizer
 from typing import List, Tuple
 
+# Tokenizing a chat turn is pure in (tokenizer, role, content) and every
+# multi-turn request re-submits its entire history, so memoize the per-turn
+# token ids; prompt building then costs O(new turn) tokenizer work instead
+# of O(whole history) per user message.
+_TOKENIZE_CACHE_MAX = 4096
+_tokenize_cache = {}
+
+
+def _tokenize_str_cached(tokenizer, role, content, nl_tokens):
+    # name_or_path is stable for a given tokenizer dir across reloads,
+    # unlike id(tokenizer), which can be recycled for a different tokenizer
+    # once the original is garbage collected
+    key = (tokenizer.name_or_path, role, content)
+    hit = _tokenize_cache.get(key)
+    if hit is None:
+        if len(_tokenize_cache) >= _TOKENIZE_CACHE_MAX:
+            # evict the oldest entry (dicts iterate in insertion order)
+            # instead of dropping the whole hot cache
+            _tokenize_cache.pop(next(iter(_tokenize_cache)))
+        hit = (
+            f"{role}\n{content}",
+            tokenizer.encode(
+                role,
+                allowed_special=set(),
+            ) + nl_tokens + tokenizer.encode(
+                content,
+                allowed_special=set(),
+            )
+        )
+        _tokenize_cache[key] = hit
+    return hit
+
 
 def make_context(
     tokenizer: PreTrainedTokenizer,
@@ -21,16 +53,9 @@ def make_context(
         nl_tokens = tokenizer.encode("\n")
 
         def _tokenize_str(role, content):
-            return (
-                f"{role}\n{content}",
-                tokenizer.encode(
-                    role,
-                    allowed_special=set(),
-                ) + nl_tokens + tokenizer.encode(
-                    content,
-                    allowed_special=set(),
-                )
-            )
+            # consumers only concatenate the returned list, so sharing the
+            # cached object across calls is safe
+            return _tokenize_str_cached(tokenizer, role, content, nl_tokens)
 
         system_text, system_tokens_part = _tokenize_str("system", system)
         system_tokens = im_start_tokens + system_tokens_part + im_end_tokens
@@ -7,7 +7,7 @@ import numpy as np
 import torch
 import tensorrt_llm
 from tensorrt_llm._utils import str_dtype_to_torch, str_dtype_to_np, pad_vocab_size, torch_to_numpy
-from tensorrt_llm.quantization import QuantMode
+from tensorrt_llm.quantization import QuantMode, WeightOnlyQuantColumnLinear
 from model import QWenForCausalLM
 
 def gen_suffix(rank, use_smooth_quant, quant_per_channel):
@@ -196,8 +196,26 @@ def load_from_ft(tensorrt_llm_qwen: QWenForCausalLM,
 
     lm_head_weight = fromfile(dir_path, 'lm_head.weight.bin',
                                   [vocab_size, hidden_size])
-    tensorrt_llm_qwen.lm_head.weight.value = np.ascontiguousarray(
+    # the model pads the vocab to a multiple of 16 x tp for tensor cores;
+    # zero-fill the extra rows (Qwen's 151936 is already aligned, so this
+    # is a no-op there)
+    vocab_size_padded = tensorrt_llm_qwen.lm_head.out_features * tensor_parallel
+    if vocab_size_padded > vocab_size:
+        lm_head_weight = np.pad(lm_head_weight,
+                                ((0, vocab_size_padded - vocab_size), (0, 0)))
+    lm_head_weight = np.ascontiguousarray(
             split(lm_head_weight, tensor_parallel, rank))
+    if isinstance(tensorrt_llm_qwen.lm_head, WeightOnlyQuantColumnLinear):
+        # lm_head-only weight-only quantization (--use_weight_only_quant_lm_head)
+        t = np.ascontiguousarray(np.transpose(lm_head_weight, [1, 0]))
+        processed_torch_weights, torch_weight_scales = torch.ops.fastertransformer.symmetric_quantize_last_axis_of_batched_matrix(
+            torch.tensor(t), torch.int8)
+        # workaround for trt not supporting int8 inputs in plugins currently
+        tensorrt_llm_qwen.lm_head.weight.value = processed_torch_weights.view(
+            dtype=torch.float32).numpy()
+        tensorrt_llm_qwen.lm_head.per_channel_scale.value = torch_weight_scales.numpy()
+    else:
+        tensorrt_llm_qwen.lm_head.weight.value = lm_head_weight
 
     tensorrt_llm_qwen.ln_f.weight.value = fromfile(dir_path, 'ln_f.weight.bin')
 
@@ -455,8 +473,25 @@ def load_from_hf_qwen(tensorrt_llm_qwen: QWenForCausalLM,
         elif 'transformer.ln_f.weight' in k:
             tensorrt_llm_qwen.ln_f.weight.value = v
         elif 'lm_head.weight' in k:
-            tensorrt_llm_qwen.lm_head.weight.value = np.ascontiguousarray(
-                split(v, tensor_parallel, rank))
+            # zero-fill up to the 16 x tp padded vocab used by the model
+            vocab_size_padded = tensorrt_llm_qwen.lm_head.out_features * \
+                tensor_parallel
+            if vocab_size_padded > v.shape[0]:
+                v = np.pad(v, ((0, vocab_size_padded - v.shape[0]), (0, 0)))
+            v = np.ascontiguousarray(split(v, tensor_parallel, rank))
+            if isinstance(tensorrt_llm_qwen.lm_head,
+                          WeightOnlyQuantColumnLinear):
+                # lm_head-only weight-only quantization
+                # (--use_weight_only_quant_lm_head)
+                t = np.ascontiguousarray(np.transpose(v, [1, 0]))
+                processed_torch_weights, torch_weight_scales = torch.ops.fastertransformer.symmetric_quantize_last_axis_of_batched_matrix(
+                    torch.tensor(t), torch.int8)
+                tensorrt_llm_qwen.lm_head.weight.value = processed_torch_weights.view(
+                    dtype=torch.float32).numpy()
+                tensorrt_llm_qwen.lm_head.per_channel_scale.value = torch_weight_scales.numpy(
+                )
+            else:
+                tensorrt_llm_qwen.lm_head.weight.value = v
         else:
             layer_idx = extract_layer_idx(k)
             if layer_idx is None:
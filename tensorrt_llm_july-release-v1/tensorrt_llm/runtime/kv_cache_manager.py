@@ -236,6 +236,25 @@ class KVCacheManager(object):
         Iterate to the next generation step.
         Add new blocks where needed and clear finished sequences.
         """
+        # The generation loop calls this once per token with a uniform mask:
+        # all-False while decoding and all-True on teardown. Handle both
+        # without the per-sequence rebuild/remap passes; `in` scans the list
+        # at C speed.
+        if True not in finished:
+            boundary = self.tokens_per_block - 1
+            for seq in self.sequences:
+                batch_idx = seq.get_batch_idx()
+                if self.lens[batch_idx] % self.tokens_per_block == boundary:
+                    self.blocks_manager.allocate(seq)
+                self.lens[batch_idx] += 1
+            return
+        if False not in finished:
+            for seq in self.sequences:
+                self.blocks_manager.free(seq)
+            self.lens = []
+            self.sequences = []
+            return
+
         for seq in self.sequences:
             batch_idx = seq.get_batch_idx()
             if not finished[batch_idx] and self.lens[
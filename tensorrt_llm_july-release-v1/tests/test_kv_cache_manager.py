@@ -331,6 +331,51 @@ class TestKVCacheManager(unittest.TestCase):
 
         check_amount_of_blocks(arrays[0][0][0][0], 2)
 
+    def test_kv_cache_manager_uniform_masks(self):
+        # step() has dedicated fast paths for the all-False (decoding) and
+        # all-True (teardown) masks; exercise both explicitly
+        blocks = 16
+        tokens_per_block = 8
+        max_blocks_per_seq = 8
+        memory_pool = torch.zeros(2,
+                                  blocks,
+                                  tokens_per_block,
+                                  64,
+                                  dtype=torch.float,
+                                  device='cuda')
+        manager = KVCacheManager(memory_pools=[memory_pool],
+                                 blocks=blocks,
+                                 tokens_per_block=tokens_per_block,
+                                 max_blocks_per_seq=max_blocks_per_seq)
+        seq0 = GenerationSequence(seq_idx=0, batch_idx=0)
+        seq1 = GenerationSequence(seq_idx=1, batch_idx=1)
+        manager.add_sequence(seq0, 6)
+        manager.add_sequence(seq1, 7)
+        self.assertEqual(len(manager.free_blocks), blocks - 2)
+
+        # all-False steps grow every length by one and allocate a new block
+        # exactly when a sequence crosses its block boundary
+        manager.step([False, False])
+        self.assertEqual(manager.lens, [7, 8])
+        self.assertEqual(manager.blocks_manager.get_number_blocks(seq0), 1)
+        self.assertEqual(manager.blocks_manager.get_number_blocks(seq1), 2)
+        # blocks come off the front of the free list in index order
+        self.assertEqual(
+            manager.blocks_manager.allocated_blocks[seq1][0][1].idx, 2)
+        self.assertEqual(len(manager.free_blocks), blocks - 3)
+
+        manager.step([False, False])
+        self.assertEqual(manager.lens, [8, 9])
+        self.assertEqual(manager.blocks_manager.get_number_blocks(seq0), 2)
+        self.assertEqual(manager.blocks_manager.get_number_blocks(seq1), 2)
+        self.assertEqual(len(manager.free_blocks), blocks - 4)
+
+        # all-True teardown frees every block and clears the bookkeeping
+        manager.step([True, True])
+        self.assertEqual(len(manager.free_blocks), blocks)
+        self.assertEqual(manager.lens, [])
+        self.assertEqual(manager.sequences, [])
+
 
 if __name__ == '__main__':
     unittest.main()